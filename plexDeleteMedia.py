@@ -6,13 +6,16 @@ It shows a list of items that will get deleted and asks 2 times if you really wa
 You can run script interactively or specify everything with these command-line arguments:
 --playlist playlistname: Playlist that contains items to be deleted
 --user username: Only for server owner: Username from which to choose the playlist (omit username to select a user from a list)
+--no-size: Only list the titles of the items without their size and warnings (faster)
 --yes: Don't ask for 'Press Y to continue' (items will get DELETED from the server without questions)
 --help: Show help
 """
 
 import argparse
 import sys
-from plexHelpers import plex_connect, select_user, select_playlist, get_file_size, size_str
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from plexHelpers import fetch_items_metadata, install_sigint_handler, plex_connect, select_user, select_playlist, get_file_size, size_str, stop_event
 
 
 def main():
@@ -29,6 +32,7 @@ def main():
         const=True,          # If --user is passed without a value, set to True
         help='Only for server owner: Username from which to choose the playlist (omit username to select a user from a list)'
     )
+    parser.add_argument('--no-size', action='store_true', help="Only list the titles of the items without their size and warnings (faster)")
     parser.add_argument('-y', '--yes', action='store_true', help="Don't ask for 'Press Y to continue' (items will get DELETED from the server without questions)")
     args = parser.parse_args()
 
@@ -47,23 +51,31 @@ def main():
     playlist = select_playlist(plex, choice=args.playlist)
     if not playlist:
         return
-
-    print('\r\033[KItems to delete:')
-    filessize = 0
-    for item in playlist.items():
-        filesize = get_file_size(item)
-        filessize += filesize
-        print(f"{item.title} ({size_str(filesize)})")
-
-        # show some warnings (i usually only delete things i haven't rated or completely viewed)
-        if item.userRating:
-            print(f"WARNING: Rating of {item.userRating/2} stars")
-
-        if item.viewCount:
-            print(f"WARNING: Was viewed {item.viewCount} times")
-
-    print(f"Total: {len(playlist.items())} items, {size_str(filessize)}")
-    print("-------------------------------------------------------------")
+    items = playlist.items() # fetch once, each call is a request to the server
+
+    # collect all lines and write them at once, on huge playlists that's much faster than printing each line
+    lines = ['\r\033[KItems to delete:']
+    if args.no_size: # just the titles, no need to load more metadata
+        lines.extend(item.title for item in items)
+        lines.append(f"Total: {len(items)} items")
+    else:
+        items = fetch_items_metadata(plex, items) # load sizes, ratings and view counts in batches instead of per item
+        filessize = 0
+        for item in items:
+            filesize = get_file_size(item)
+            filessize += filesize
+            lines.append(f"{item.title} ({size_str(filesize)})")
+
+            # show some warnings (i usually only delete things i haven't rated or completely viewed)
+            if item.userRating:
+                lines.append(f"WARNING: Rating of {item.userRating/2} stars")
+
+            if item.viewCount:
+                lines.append(f"WARNING: Was viewed {item.viewCount} times")
+
+        lines.append(f"Total: {len(items)} items, {size_str(filessize)}")
+    lines.append("-------------------------------------------------------------")
+    sys.stdout.write('\n'.join(lines) + '\n')
 
     # double security check before deleting
     if not args.yes:
@@ -77,13 +89,39 @@ def main():
             print("Aborted.")
             sys.exit(1)
 
-    # delete items
-    print("Deleting...", end="", flush=True)
-    for item in playlist.items():
-        item.delete()
+    def delete_item(item):
+        """
+        Deletes the item, returns the error message on failure so one failed item doesn't abort the others.
+        """
+        if stop_event.is_set(): # Ctrl+C was pressed
+            return f"{item.title}: not deleted, stopped by user"
+        try:
+            item.delete()
+        except Exception as e:
+            return f"{item.title}: {e}"
+
+    # delete items in parallel
+    errors = []
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        futures = [executor.submit(delete_item, item) for item in items]
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Deleting", unit="item"):
+                error = future.result()
+                if error:
+                    errors.append(error)
+        except BaseException: # i.e. Ctrl+C: don't delete the remaining items (leaving the with block would wait for all of them)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    if errors:
+        print(f"\r\033[KFailed to delete {len(errors)} items:")
+        for error in errors:
+            print(error)
+        sys.exit(1)
 
     print("\r\033[KFinished")
 
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
\ No newline at end of file
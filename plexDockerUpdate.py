@@ -1,31 +1,55 @@
 #!/usr/bin/env python3
 """
 Restart plex's docker container when a plex update available, but only when nobody is streaming currently.
+
+When plex was up-to-date on a run within the last 5 minutes, the server isn't asked again (useful when run as cronjob).
 """
 
-from plexHelpers import plex_connect
-import docker
-import requests
+import argparse
+import json
+import os
+import time
+from plexHelpers import install_sigint_handler, is_latest, plex_connect
 
 
-def is_latest(plex):
-    """
-    Returns True if the installed version of Plex Media Server is the latest.
+state_file = os.path.join(os.path.expanduser('~'), '.cache', 'plex-helpers', 'state.json')
+
 
-    Like isLatest from plexapi but that seems to always return true, but it works when '?X-Plex-Product=Plex%20Web' is specified.
+def load_cached_is_latest(ttl=300):
+    """
+    Returns True if plex was up-to-date on a check within the last ttl seconds.
     """
-    headers = {'Accept': 'application/json', 'X-Plex-Token': plex._token}
-    url = f'{plex._baseurl}/updater/status?X-Plex-Product=Plex%20Web'
-    response = requests.get(url, headers=headers)
     try:
-        return response.ok and response.json()['MediaContainer']['size'] == 0
-    except:
-        return True
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        return state['isLatest'] is True and time.time() - state['timestamp'] < ttl
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def save_cached_is_latest(isLatest):
+    """
+    Saves the result of the update check, the file is replaced atomically.
+    """
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'isLatest': isLatest, 'timestamp': time.time()}, f)
+    os.replace(tmp_file, state_file)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.description = "Restart plex's docker container when a plex update available, but only when nobody is streaming currently"
+    parser.parse_args()
+
+    if load_cached_is_latest():
+        print("\r\033[KAlready up-to-date")
+        return
+
     plex = plex_connect()
-    isLatest = plex.isLatest() and is_latest(plex)
+    isLatest = is_latest(plex) # plexapi's plex.isLatest() always returns True, so it's not worth an extra request
+    save_cached_is_latest(isLatest)
     sessions = plex.sessions()
 
     if isLatest:
@@ -35,9 +59,11 @@ def main():
         print("\r\033[KSomebody's playing")
 
     if not isLatest and not sessions:
+        import docker # importing docker is slow, only do it when it's needed
         client = docker.from_env()
         container = client.containers.get('plex')
         container.restart()
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
@@ -11,13 +11,16 @@ You can run script interactively or specify everything with these command-line a
 --playlist playlistname: Playlist that contains items to be downloaded
 --user username: Only for server owner: Username from which to choose the playlist (omit username to select a user from a list)
 --destination path: Destination path for downloaded items (without it you can interactively choose removeable/mounted destinations)
+--jobs N: Number of items downloaded in parallel (default 3)
 --yes: Don't ask for 'Press Y to continue' (items will get downloaded without questions)
 --help: Show help
 """
 
 import argparse
+import queue
 import sys
-from plexHelpers import download_item, plex_connect, select_destination, select_playlist, select_user, size_str
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from plexHelpers import download_item, install_sigint_handler, plex_connect, select_destination, select_playlist, select_user, size_str, would_download_bytes
 
 
 def main():
@@ -39,6 +42,7 @@ def main():
         type=str,
         help="Destination path for downloaded items (without it you can interactively choose removeable/mounted destinations)"
     )
+    parser.add_argument('-j', '--jobs', type=int, default=3, help="Number of items downloaded in parallel (default 3)")
     parser.add_argument('-y', '--yes', action='store_true', help="Don't ask for 'Press Y to continue' (items will get downloaded without questions)")
     args = parser.parse_args()
 
@@ -57,24 +61,30 @@ def main():
     playlist = select_playlist(plex, choice=args.playlist)
     if not playlist:
         return
+    items = playlist.items() # fetch once, each call is a request to the server
 
     destination = args.destination
     if not destination:
         destination = select_destination(['Downloads'])
 
-    print('\r\033[KItems to download:')
+    # check local files in parallel, only partially downloaded files need a request to the server
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        sizes = list(executor.map(lambda item: would_download_bytes(plex, item, destination), items))
+
+    # collect all lines and write them at once, on huge playlists that's much faster than printing each line
+    lines = ['\r\033[KItems to download:']
     itemCount = 0
     filessize = 0
-    for item in playlist.items():
-        filesize = download_item(plex, item, True, destination) # returns how many bytes would be downloaded
+    for item, filesize in zip(items, sizes):
         if filesize > 0:
             itemCount += 1
             filessize += filesize
-            print(f"{item.title} ({size_str(filesize)})")
+            lines.append(f"{item.title} ({size_str(filesize)})")
         # else: file already exists locally
 
-    print(f"Total: {itemCount} items, {size_str(filessize)}")
-    print("-------------------------------------------------------------")
+    lines.append(f"Total: {itemCount} items, {size_str(filessize)}")
+    lines.append("-------------------------------------------------------------")
+    sys.stdout.write('\n'.join(lines) + '\n')
 
     if not args.yes:
         choice = input("Press Y to continue downloading: ").strip().lower()
@@ -82,12 +92,33 @@ def main():
             print("Aborted.")
             sys.exit(1)
 
-    # download items
-    for i, item in enumerate(playlist.items(), start=1):
-        download_item(plex, item, False, destination, f"[{i}/{itemCount}] {item.title[:20]}")
+    # download items in parallel, only those which are not completely downloaded yet
+    pending = [item for item, filesize in zip(items, sizes) if filesize > 0]
+    jobs = max(1, args.jobs)
+    # each running download gets its own line for the progress bar, so parallel bars don't overwrite each other
+    positions = queue.Queue()
+    for position in range(jobs):
+        positions.put(position)
+
+    def download(i, item):
+        position = positions.get()
+        try:
+            download_item(plex, item, False, destination, f"[{i}/{itemCount}] {item.title[:20]}", position=position)
+        finally:
+            positions.put(position)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(download, i, item) for i, item in enumerate(pending, start=1)]
+        try:
+            for future in as_completed(futures):
+                future.result() # raise exceptions from the download threads
+        except BaseException: # i.e. Ctrl+C: don't start the remaining downloads (leaving the with block would wait for all of them)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     print("Finished")
 
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
\ No newline at end of file
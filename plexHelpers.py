@@ -6,11 +6,12 @@ Note about print(): \r\033[K = jump to line start and flush line
 """
 
 import datetime
+import functools
 import getpass
+import hashlib
 import json
 import math
 import os
-import pathlib
 import platform
 import re
 import requests
@@ -19,110 +20,490 @@ import signal
 import stat
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 from typing import Optional, Literal
-from plexapi.myplex import MyPlexAccount
-from plexapi.server import PlexServer
+from urllib3.util.retry import Retry
+try:
+    import pycurl # optional, faster downloads via libcurl
+except ImportError:
+    pycurl = None
+try:
+    from orjson import loads as json_loads # optional, parses json much faster than the json module
+except ImportError:
+    from json import loads as json_loads
 
 
+# Chunk size for streaming downloads, bigger chunks need less python-level iterations per MB
+DEFAULT_DOWNLOAD_CHUNK = 256*1024  # 256 Kibibyte
+# Files bigger than this are downloaded with multiple connections in parallel, each downloading a byte range of the file
+RANGE_DOWNLOAD_THRESHOLD = 128*1024*1024  # 128 Mebibyte
+
+
+# Set on Ctrl+C (see handle_sigint), tasks running in threads check it to stop early (threads can't be interrupted from outside)
+stop_event = threading.Event()
+
+
+# Replaces all characters forbidden on the windows NTFS filesystem with a space, used in clean_path_part()
+forbidden_characters_table = str.maketrans({c: ' ' for c in r'<>/\\:"|?*'})
+multiple_spaces_pattern = re.compile(r'  +')
+
+
+@functools.lru_cache(maxsize=8192)
 def clean_path_part(pathPart):
     """
     Remove illegal characters that are forbidden in path parts on Windows.
     Note: do not specify a full path containing path separators, those will get removed.
+    The result is cached, as the same folder names (artists, albums, seasons) repeat a lot.
+    """
+    return multiple_spaces_pattern.sub(' ', pathPart.translate(forbidden_characters_table))
+
+
+def compare_partial_file(plex, part, file, chunk_size: int = DEFAULT_DOWNLOAD_CHUNK):
+    """
+    Checks if a partially downloaded file is still the same file as on the server, so the download can be resumed.
+
+    Without any request: when the part and its size didn't change since the download started, the hash of the first 1MB
+    of the local file is compared with the hash saved while downloading (the local file wasn't modified).
+    Then a HEAD request checks the ETag/Last-Modified headers against the ones saved when the download started.
+    When the server doesn't send those headers or they don't match, it downloads the first 1MB and compares it with the local file.
+    plexapi doesn't show when the file was last modified (only the metadata).
+    So whenever the filesizes from the local and remote file differ there is no other
+    option than to download the first part and compare it to tell if the file needs to
+    be completely re-downloaded (file on server changed) or the download can be resumed.
+    """
+    state = load_download_state(file)
+    local_unchanged = False # the first 1MB of the local file are the ones written by the download
+    if state.get('sha256') and state.get('part') == part.key and os.path.getsize(file) >= first_bytes_size:
+        local_unchanged = get_first_bytes_hash(file) == state['sha256']
+    if local_unchanged and state.get('size') == part.size:
+        return True  # same part with same size, local file unchanged
+
+    # the server's ETag/Last-Modified only tell that the file on the server is unchanged, so they're only used when the local
+    # file is unchanged too (or too small to have a saved hash), otherwise the data is compared
+    url = f'{plex._baseurl}{part.key}'
+    if local_unchanged or os.path.getsize(file) < first_bytes_size:
+        response = plex._session.head(url, headers={'X-Plex-Token': plex._token}, timeout=(3, 10))
+        response.raise_for_status()
+        validators = get_validators(response.headers)
+        if validators and state.get('part') == part.key and validators == state.get('validators'):
+            return True  # file on the server didn't change
+
+    byte_limit = min(first_bytes_size, os.path.getsize(file)) # 1MB or filesize when file is smaller
+    headers = {'Range': f'bytes=0-{byte_limit - 1}', 'X-Plex-Token': plex._token}
+    # closing the response returns the connection to the pool, even when not all data was read
+    with plex._session.get(url, headers=headers, stream=True) as response, open(file, 'rb') as local_file:
+        total = 0
+        for remote_chunk in read_chunks(response, chunk_size):
+            local_chunk = local_file.read(len(remote_chunk))
+            if remote_chunk != local_chunk:
+                return False  # Files differ
+            total += len(remote_chunk)
+            if total >= byte_limit:
+                break
+
+    return True  # First 1MB are the same
+
+
+# Download state of files (i.e. ETag/Last-Modified headers) is saved in this file in each download directory
+download_state_filename = '.plexdl.json'
+download_state_lock = threading.Lock() # downloads may run in parallel
+# Number of bytes at the start of a file used to check if a partially downloaded file is unchanged
+first_bytes_size = 1024*1024  # 1MB
+# Progress of downloads with multiple connections is saved after each range downloaded this many bytes
+range_state_interval = 16*1024*1024  # 16MB
+
+
+def get_first_bytes_hash(file):
+    """
+    Returns the sha256 hash of the first 1MB of the file.
+    """
+    with open(file, 'rb') as f:
+        return hashlib.sha256(f.read(first_bytes_size)).hexdigest()
+
+
+def save_first_bytes_hash(file, part, written, length):
+    """
+    Called for each written chunk of a download, saves the hash of the first 1MB as soon as they are written.
+    written is the file size before the chunk was written, length the size of the chunk.
+    """
+    if written < first_bytes_size <= written + length:
+        save_download_state(file, part=part.key, size=part.size, sha256=get_first_bytes_hash(file))
+
+
+def load_download_state(file):
     """
-    # this are all characters forbidden on the windows NTFS filesystem
-    forbidden_characters = r'<>/\\:"|?*'
+    Returns the saved download state of the file, or an empty dict.
+    """
+    state_file = os.path.join(os.path.dirname(file), download_state_filename)
+    with download_state_lock:
+        try:
+            with open(state_file, 'rb') as f:
+                return json_loads(f.read()).get(os.path.basename(file), {})
+        except (OSError, ValueError):
+            return {}
+
 
-    for x in forbidden_characters:
-        pathPart = pathPart.replace(x, ' ')
-    while '  ' in pathPart:
-        pathPart = pathPart.replace('  ', ' ')
-    return pathPart
+def save_download_state(file, **values):
+    """
+    Saves values to the download state of the file, i.e. save_download_state(file, validators={'ETag': '...'}).
+    """
+    state_file = os.path.join(os.path.dirname(file), download_state_filename)
+    with download_state_lock:
+        try:
+            with open(state_file, 'rb') as f:
+                states = json_loads(f.read())
+        except (OSError, ValueError):
+            states = {}
+        states.setdefault(os.path.basename(file), {}).update(values)
+        write_download_states(state_file, states)
 
 
-def download_item(plex, item, skipDownload = False, basepath: Optional[str] = 'Downloads', description: Optional[str] = 'Downloading'):
+def remove_download_state(file):
+    """
+    Removes the download state of the file when its download is complete, the state file is removed when it's empty.
+    """
+    state_file = os.path.join(os.path.dirname(file), download_state_filename)
+    with download_state_lock:
+        try:
+            with open(state_file, 'rb') as f:
+                states = json_loads(f.read())
+        except (OSError, ValueError):
+            return
+        if states.pop(os.path.basename(file), None) is None:
+            return
+        if states:
+            write_download_states(state_file, states)
+        else:
+            os.remove(state_file)
+
+
+def write_download_states(state_file, states):
+    """
+    Writes the download states into a temporary file which then replaces the state file,
+    so an interrupted write (i.e. Ctrl+C) never leaves a truncated state file which would lose the states of all files.
+    """
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(states, f, indent=4)
+    os.replace(tmp_file, state_file)
+
+
+def download_item(plex, item, skipDownload = False, basepath: Optional[str] = 'Downloads', description: Optional[str] = 'Downloading', chunk_size: int = DEFAULT_DOWNLOAD_CHUNK, max_workers: int = 4, use_pycurl: bool = True, position: Optional[int] = None):
     """
     Downloads all media parts of the specified item into the basepath directory.
     Existing files with correct filesize are skipped, otherwise the download is resumed.
+    Items with multiple parts (i.e. multi-file movies) download up to max_workers parts in parallel.
+    When pycurl is installed and use_pycurl = True, the files are downloaded via libcurl which is much faster than requests.
+
+    When skipDownload = True then no files are downloaded, the function just returns how many bytes would be downloaded
+    (same as would_download_bytes()).
 
-    When skipDownload = True then no files are downloaded, the function just returns how many bytes would be downloaded.
+    When multiple items are downloaded in parallel, each needs its own position for the progress bar so the bars
+    don't overwrite each other. Bars with a position are removed when the download is finished.
 
     Note: plexapi provides item.download() but that doesn't provide a progress bar
     so this function downloads the files manually to be able to show a progress.
     """
-    chunk_size = 64*1024  # 64 Kibibyte
+    if skipDownload:
+        return would_download_bytes(plex, item, basepath)
 
-    def compare_partial_file(plex, part, file):
-        """
-        Downloads the first 1MB and compares it with the local file.
-        plexapi doesn't show when the file was last modified (only the metadata).
-        So whenever the filesizes from the local and remote file differ there is no other
-        option than to download the first part and compare it to tell if the file needs to
-        be completely re-downloaded (file on server changed) or the download can be resumed.
-        """
-        byte_limit = min(1024*1024, os.path.getsize(file)) # 1MB or filesize when file is smaller
-        headers = {'Range': f'bytes=0-{byte_limit - 1}', 'X-Plex-Token': plex._token}
-        response = requests.get(f'{plex._baseurl}{part.key}', headers=headers, stream=True)
+    tasks = [] # (part, file, existing_filesize, ranges) of each part that needs to be downloaded
+    total_download_size = 0
+    part_files = get_part_files(item, basepath)
+    local_sizes = get_local_file_sizes(file for _, file in part_files)
+    for part, file in part_files:
+        total_download_size += part.size
+        existing_filesize = 0
+        ranges = None
+        if file not in local_sizes:
+            ranges = get_partial_ranges(plex, part, file)
+            if ranges is not None: # interrupted download with multiple connections, resume the missing ranges
+                existing_filesize = part.size - sum(end - offset + 1 for offset, end in ranges)
+                total_download_size -= existing_filesize
+        else:
+            existing_filesize = local_sizes[file]
+            if part.size == existing_filesize:
+                total_download_size -= existing_filesize
+                continue # file already exists
+            else:
+                if compare_partial_file(plex, part, file, chunk_size): # file exists partially, resume downloading
+                    total_download_size -= existing_filesize
+                else: # file was updated on the server, needs to be downloaded again
+                    existing_filesize = 0
+                    os.remove(file)
+        tasks.append((part, file, existing_filesize, ranges))
+
+    if not tasks:
+        return total_download_size
+
+    # one progress bar for all parts of the item
+    with tqdm(
+        desc=description,
+        total=sum(part.size for part, _, _, _ in tasks),
+        initial=sum(existing_filesize for _, _, existing_filesize, _ in tasks),
+        unit='iB',
+        unit_scale=True,
+        unit_divisor=1024,
+        position=position,
+        leave=position is None,
+    ) as bar:
+        bar_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(download_part, plex, part, file, existing_filesize, bar, bar_lock, chunk_size, use_pycurl, ranges)
+                       for part, file, existing_filesize, ranges in tasks]
+            try:
+                for future in as_completed(futures):
+                    future.result() # raise exceptions from the download threads
+            except BaseException: # i.e. Ctrl+C: don't start the remaining parts (leaving the with block would wait for all of them)
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
-        with open(file, 'rb') as local_file:
-            total = 0
-            for remote_chunk in response.iter_content(chunk_size):
-                local_chunk = local_file.read(len(remote_chunk))
-                if remote_chunk != local_chunk:
-                    return False  # Files differ
-                total += len(remote_chunk)
-                if total >= byte_limit:
-                    break
+    return total_download_size
 
-        return True  # First 1MB are the same
 
+def download_part(plex, part, file, existing_filesize, bar, bar_lock, chunk_size: int = DEFAULT_DOWNLOAD_CHUNK, use_pycurl: bool = True, ranges = None):
+    """
+    Downloads a media part into file, resumes the download when existing_filesize > 0.
+    An interrupted download with multiple connections is resumed with the missing ranges (see get_partial_ranges()).
+    The progress bar is shared between parallel downloads, so it's only updated while holding bar_lock.
+    """
+    if ranges is not None or (existing_filesize == 0 and part.size > RANGE_DOWNLOAD_THRESHOLD):
+        return download_part_ranges(plex, part, file, bar, bar_lock, chunk_size=chunk_size, ranges=ranges)
+
+    # create local directory for download
+    path = os.path.dirname(file)
+    os.makedirs(path, exist_ok=True)
+
+    if use_pycurl and pycurl:
+        return download_part_pycurl(plex, part, file, existing_filesize, bar, bar_lock, chunk_size)
+
+    # download with progress bar, resume existing files
+    headers = {'X-Plex-Token': plex._token, 'Accept-Encoding': 'identity'} # media files are already compressed
+    if existing_filesize > 0:
+        headers['Range'] = f'bytes={existing_filesize}-'
+    with plex._session.get(f'{plex._baseurl}{part.key}', headers=headers, stream=True) as response:
+        # check the status before anything is saved or written, so an error page is never written into the file
+        response.raise_for_status()
+        if existing_filesize > 0 and response.status_code != 206: # server ignored the range, the whole file would be appended
+            raise Exception(f"[ERROR {response.status_code}] downloading {part.key}: server didn't return the range {existing_filesize}-")
+        # save ETag/Last-Modified, so an interrupted download can be verified without downloading data
+        save_download_state(file, part=part.key, validators=get_validators(response.headers))
+
+        # unbuffered, the chunks are big enough to be written directly without copying them into a buffer first
+        mode = 'ab' if existing_filesize > 0 else 'wb'
+        written = existing_filesize
+        with open(file, mode, buffering=0) as f:
+            for data in read_chunks(response, chunk_size):
+                if stop_event.is_set(): # Ctrl+C, the partial file is resumed on the next run
+                    raise Exception(f"Download of {file} stopped by user")
+                f.write(data)
+                save_first_bytes_hash(file, part, written, len(data))
+                written += len(data)
+                with bar_lock:
+                    bar.update(len(data))
+
+    if written == part.size: # complete, the state is only needed to resume downloads
+        remove_download_state(file)
 
-    total_download_size = 0
-    section = item.section()
-    for media_ix, media in enumerate(item.media):
-        for part_ix, part in enumerate(media.parts):
-            total_download_size += part.size
-            existing_filesize = 0
-            file = os.path.join(basepath, section.title, unique_path(section, item, media_ix, part_ix))
-            if os.path.exists(file):
-                existing_filesize = os.path.getsize(file)
-                if part.size == existing_filesize:
-                    total_download_size -= existing_filesize
-                    continue # file already exists
-                else:
-                    if compare_partial_file(plex, part, file): # file exists partially, resume downloading
-                        total_download_size -= existing_filesize
-                    else: # file was updated on the server, needs to be downloaded again
-                        existing_filesize = 0
-                        if not skipDownload: os.remove(file)
-            if skipDownload:
-                continue
 
-            # create local directory for download
-            path = os.path.dirname(file)
-            if not os.path.isdir(path):
-                os.makedirs(path)
-
-            # download with progress bar, resume existing files
-            headers = {'X-Plex-Token': plex._token}
-            if existing_filesize > 0:
-                headers.extend({"Range": f"bytes={existing_filesize}-"})
-            response = requests.get(f'{plex._baseurl}{part.key}', headers=headers, stream=True)
-
-            mode = 'ab' if existing_filesize > 0 else 'wb'
-            with open(file, mode) as f, tqdm(
-                desc=description,
-                total=part.size,
-                initial=existing_filesize,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as bar:
-                for data in response.iter_content(chunk_size):
+def download_part_pycurl(plex, part, file, existing_filesize, bar, bar_lock, chunk_size: int = DEFAULT_DOWNLOAD_CHUNK):
+    """
+    Same as download_part(), but downloads via libcurl (pycurl) which receives the data in C instead of
+    requests' python code, that is much faster on fast networks.
+    """
+    status = 0
+    headers = requests.structures.CaseInsensitiveDict()
+    def header_function(line):
+        nonlocal status
+        line = line.decode('iso-8859-1')
+        if line.startswith('HTTP/'): # status line, i.e. 'HTTP/1.1 206 Partial Content' (a new one for each redirect)
+            status = int(line.split()[1])
+            headers.clear()
+            return
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip()] = value.strip()
+
+    # the file is opened with the first data, so a failed request doesn't touch it
+    f = None
+    written = existing_filesize
+    error = None
+    def write_function(data):
+        nonlocal f, written, error
+        if stop_event.is_set(): # Ctrl+C, returning a different length than received aborts the transfer
+            return 0
+        if f is None:
+            # a resumed download must get the requested range, otherwise the whole file would be appended
+            if existing_filesize > 0 and status != 206:
+                error = f"[ERROR {status}] downloading {part.key}: server didn't return the range {existing_filesize}-"
+                return 0
+            # save ETag/Last-Modified, so an interrupted download can be verified without downloading data
+            save_download_state(file, part=part.key, validators=get_validators(headers))
+            # unbuffered, see download_part()
+            f = open(file, 'ab' if existing_filesize > 0 else 'wb', buffering=0)
+        f.write(data)
+        save_first_bytes_hash(file, part, written, len(data))
+        written += len(data)
+        with bar_lock:
+            bar.update(len(data))
+
+    c = pycurl.Curl()
+    try:
+        c.setopt(pycurl.URL, f'{plex._baseurl}{part.key}')
+        c.setopt(pycurl.HTTPHEADER, [f'X-Plex-Token: {plex._token}'])
+        if existing_filesize > 0:
+            c.setopt(pycurl.RANGE, f'{existing_filesize}-')
+        c.setopt(pycurl.FOLLOWLOCATION, True)
+        c.setopt(pycurl.FAILONERROR, True) # fail on status >= 400 without passing the error page to write_function
+        c.setopt(pycurl.BUFFERSIZE, chunk_size)
+        c.setopt(pycurl.HEADERFUNCTION, header_function)
+        c.setopt(pycurl.WRITEFUNCTION, write_function)
+        try:
+            c.perform()
+        except pycurl.error as e:
+            raise Exception(error or f"[ERROR] downloading {part.key}: {e}") from e
+    finally:
+        c.close()
+        if f:
+            f.close()
+
+    if written == part.size: # complete, the state is only needed to resume downloads
+        remove_download_state(file)
+
+
+def download_part_ranges(plex, part, file, bar, bar_lock, connections: int = 4, chunk_size: int = DEFAULT_DOWNLOAD_CHUNK, ranges = None):
+    """
+    Downloads a media part with multiple connections in parallel, each connection downloads one byte range of the file.
+    This is faster for big files when the bandwidth of a single connection is limited.
+
+    The data is written into the preallocated file '<file>.part' which is renamed to file when the download is complete.
+    So an interrupted download never leaves a file with the full size that would be mistaken as complete.
+    The progress of each range is saved in the download state as [offset, end] (next byte to download, last byte of the range),
+    pass the ranges from get_partial_ranges() to resume an interrupted download.
+    """
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp_file = file + '.part'
+    if ranges is None: # new download, split the file into one range per connection
+        range_size = math.ceil(part.size / connections)
+        ranges = [[start, min(start + range_size, part.size) - 1] for start in range(0, part.size, range_size)]
+        mode = 'wb'
+        save_download_state(file, part=part.key, size=part.size, ranges=ranges, validators=None) # validators are saved from the responses
+    else: # resume, keep the already downloaded data
+        mode = 'r+b'
+
+    # all ranges write into the same unbuffered file (see download_part()) at their own offsets
+    with open(tmp_file, mode, buffering=0) as f:
+        if mode == 'wb':
+            # set the full size at once (sparse file, no data written), so the size isn't updated on each write
+            # Note: posix_fallocate isn't used, on filesystems without native support (i.e. vfat/exFAT) it writes the whole file first
+            f.truncate(part.size)
+
+        write_lock = threading.Lock()
+        def write_at(data, offset):
+            if hasattr(os, 'pwrite'): # positioned write, one syscall and no shared file position between threads
+                os.pwrite(f.fileno(), data, offset)
+            else: # windows has no pwrite, seek and write must not be interleaved by other threads
+                with write_lock:
+                    f.seek(offset)
                     f.write(data)
-                    bar.update(len(data))
 
-    return total_download_size
+        def download_range(r):
+            start, end = r
+            if start > end:
+                return # range already downloaded
+            offset = start
+            headers = {'Range': f'bytes={start}-{end}', 'X-Plex-Token': plex._token, 'Accept-Encoding': 'identity'}
+            with plex._session.get(f'{plex._baseurl}{part.key}', headers=headers, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code != 206: # i.e. 200 with the whole file, would be written at the wrong offset
+                    raise Exception(f"[ERROR {response.status_code}] downloading {part.key}: server didn't return the range {start}-{end}")
+                # save ETag/Last-Modified, so an interrupted download can be verified without downloading data
+                save_download_state(file, validators=get_validators(response.headers))
+                saved_offset = offset
+                try:
+                    for data in read_chunks(response, chunk_size):
+                        if stop_event.is_set(): # Ctrl+C
+                            raise Exception(f"Download of {file} stopped by user")
+                        if offset + len(data) > end + 1:
+                            raise Exception(f"Downloading {part.key}: server returned more data than the range {start}-{end}")
+                        write_at(data, offset)
+                        offset += len(data)
+                        r[0] = offset
+                        with bar_lock:
+                            bar.update(len(data))
+                        if offset - saved_offset >= range_state_interval:
+                            save_download_state(file, ranges=ranges)
+                            saved_offset = offset
+                finally: # save the progress also when the download is interrupted, so it can be resumed
+                    save_download_state(file, ranges=ranges)
+                if offset != end + 1: # connection closed early, the missing data would be a hole of zeros in the file
+                    raise Exception(f"Downloading {part.key}: incomplete range, got {offset - start} of {end - start + 1} bytes")
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [executor.submit(download_range, r) for r in ranges]
+            try:
+                for future in as_completed(futures):
+                    future.result() # raise exceptions from the download threads
+            except BaseException: # i.e. Ctrl+C: don't start the remaining ranges (leaving the with block would wait for all of them)
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    if any(offset <= end for offset, end in ranges): # never rename an incomplete file, it would be taken as complete
+        raise Exception(f"Download of {file} incomplete")
+    os.replace(tmp_file, file)
+    remove_download_state(file) # complete, the state is only needed to resume downloads
+
+
+def get_partial_ranges(plex, part, file, remove_stale = True):
+    """
+    Returns the ranges that still need to be downloaded of an interrupted download_part_ranges() download
+    as list of [offset, end], or None when there is no '<file>.part' file or it can't be resumed.
+    It can be resumed when it's the same part with the same size and the ETag/Last-Modified headers didn't change
+    (when the server doesn't send those, the same part and size is assumed to be the same file).
+    When remove_stale = True a '<file>.part' file that can't be resumed is removed.
+    """
+    tmp_file = file + '.part'
+    if not os.path.exists(tmp_file):
+        return None
+
+    state = load_download_state(file)
+    ranges = state.get('ranges')
+    if ranges and state.get('part') == part.key and state.get('size') == part.size and os.path.getsize(tmp_file) == part.size:
+        validators = state.get('validators')
+        if not validators:
+            return ranges
+        response = plex._session.head(f'{plex._baseurl}{part.key}', headers={'X-Plex-Token': plex._token}, timeout=(3, 10))
+        response.raise_for_status()
+        if get_validators(response.headers) == validators:
+            return ranges
+
+    if remove_stale:
+        os.remove(tmp_file)
+    return None
+
+
+def fetch_items_metadata(plex, items, batch_size=100):
+    """
+    Loads the full metadata of the items with one request per batch_size items instead of one request per item.
+
+    Accessing attributes that are missing on partially loaded items (i.e. playlist items) makes plexapi
+    reload each item separately, plex accepts comma-separated ratingKeys to load many items at once.
+    """
+    fullItems = []
+    for i in range(0, len(items), batch_size):
+        keys = ','.join(str(item.ratingKey) for item in items[i:i + batch_size])
+        fullItems.extend(plex.fetchItems(f'/library/metadata/{keys}'))
+    return fullItems
+
+
+def get_validators(headers):
+    """
+    Returns the headers of a response that tell if a file on the server changed (ETag and Last-Modified).
+    """
+    return {k: headers[k] for k in ('ETag', 'Last-Modified') if k in headers}
 
 
 def get_file_size(item):
@@ -132,6 +513,49 @@ def get_file_size(item):
             filesize += part.size
     return filesize
 
+def get_local_file_sizes(files):
+    """
+    Returns the sizes of the locally existing files as dict file -> size, missing files are not included.
+    Each directory is listed once via os.scandir() instead of checking each file with exists() and getsize().
+    Files not found by their exact name in the listing are checked with os.stat(), on normalizing or case-insensitive
+    filesystems (i.e. HFS+, SMB shares) the listed name may differ from the name the file was saved with.
+    """
+    files_by_directory = {}
+    for file in files:
+        files_by_directory.setdefault(os.path.dirname(file), []).append(file)
+
+    sizes = {}
+    for directory, dir_files in files_by_directory.items():
+        try:
+            with os.scandir(directory or '.') as it:
+                entries = {entry.name: entry for entry in it}
+        except OSError: # directory doesn't exist (yet)
+            continue
+        for file in dir_files:
+            entry = entries.get(os.path.basename(file))
+            if entry:
+                if entry.is_file():
+                    sizes[file] = entry.stat().st_size
+                continue
+            try:
+                file_stat = os.stat(file)
+            except OSError: # file doesn't exist
+                continue
+            if stat.S_ISREG(file_stat.st_mode):
+                sizes[file] = file_stat.st_size
+    return sizes
+
+
+def get_part_files(item, basepath: Optional[str] = 'Downloads'):
+    """
+    Returns a list of (part, file) tuples with the local download path of each media part of the item.
+    """
+    section = item.section()
+    return [(part, os.path.join(basepath, section.title, unique_path(section, item, media_ix, part_ix)))
+            for media_ix, media in enumerate(item.media)
+            for part_ix, part in enumerate(media.parts)]
+
+
 class MyFilterChoice:
     """
     Minimal version of plexapi.library.FilterChoice
@@ -143,23 +567,35 @@ class MyFilterChoice:
     def __repr__(self):
         return f"<MyFilterChoice:{self.key}:{self.title}>"
 
-def get_moods_via_autocomplete(plex, section, query):
+# Loaded moods, so repeated lookups don't need a request to the server
+moods_cache = {} # (section.key, lowercase query) -> list of moods, see get_moods_via_autocomplete()
+
+
+def get_moods_via_autocomplete(plex, section, query, refresh=False):
     """
     Loads a list of moods, starting with query, using the autocomplete feature that is used in the plex web UI.
 
     You can also run section.listFilterChoices('mood', 'track'), but that is much slower and loads all moods without filtering.
     This returns a list of MyFilterChoice objects, so it's a faster drop-in replacement for listFilterChoices.
+
+    The result is cached per section and query, use refresh=True after moods were added or removed.
     """
-    url = f'{plex._baseurl}/library/sections/{section.key}/autocomplete?type=10&mood.query={query}'
+    cache_key = (section.key, query.lower())
+    if not refresh and cache_key in moods_cache:
+        return moods_cache[cache_key]
+
+    url = f'{plex._baseurl}/library/sections/{section.key}/autocomplete'
+    params = {'type': 10, 'mood.query': query} # passed as params so the query gets url encoded (i.e. playlist names with '&')
     headers = {'Accept': 'application/json', 'X-Plex-Token': plex._token}
-    response = requests.get(url, headers=headers)
+    response = plex._session.get(url, params=params, headers=headers)
     moods = []
-    media_container = response.json()['MediaContainer']
+    media_container = json_loads(response.content)['MediaContainer']
     if 'Directory' in media_container:
         for m in media_container['Directory']:
             # Translate the json response to a MyFilterChoice object ('id'->key, 'tag'->title)
             # to be a drop-in replacement for listFilterChoices.
             moods.append(MyFilterChoice(key=m['id'], title=m['tag']))
+    moods_cache[cache_key] = moods
     return moods
 
 
@@ -194,7 +630,10 @@ def get_track_quality(track):
     codec = getattr(media, 'audioCodec', None) # can be present with value None!
     if not codec:
         try: # try to parse codec from filename
-            codec = pathlib.PurePath(media.parts[0].file).suffix[1:].lower()
+            # rpartition is much faster than pathlib, the extension must not contain a path separator (dot in a directory name)
+            _, dot, extension = media.parts[0].file.rpartition('.')
+            if dot and '/' not in extension and '\\' not in extension:
+                codec = extension.lower()
         except:
             pass
     if codec: # translate codec to a quality rank
@@ -210,6 +649,23 @@ def get_track_quality(track):
     return (codec_rank, bitrate, sample_rate, notHasMood)
 
 
+def is_latest(plex):
+    """
+    Returns True if the installed version of Plex Media Server is the latest.
+
+    Like isLatest from plexapi but that seems to always return true, but it works when '?X-Plex-Product=Plex%20Web' is specified.
+    Uses the server's session (plex._session) to reuse its connection.
+    """
+    headers = {'Accept': 'application/json', 'X-Plex-Token': plex._token}
+    url = f'{plex._baseurl}/updater/status?X-Plex-Product=Plex%20Web'
+    try:
+        response = plex._session.get(url, headers=headers, timeout=(3, 10)) # without a timeout a stuck server would block forever
+        response.raise_for_status()
+        return json_loads(response.content)['MediaContainer']['size'] == 0
+    except (requests.RequestException, KeyError, ValueError): # ValueError includes json and orjson decode errors
+        return True
+
+
 def mood_add(track, moodName):
     """
     Adds a mood to the track.
@@ -233,21 +689,39 @@ def mood_del(track, moodName):
             track.removeMood(moodName)
 
 
+def create_session():
+    """
+    Creates a requests session with a connection pool, so all requests to the plex server reuse their connections
+    instead of doing a new TCP (and TLS) handshake for each request.
+    With pool_block parallel requests wait for a free connection of the pool instead of opening additional
+    connections that are thrown away afterwards.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, pool_block=True, max_retries=Retry(total=3, backoff_factor=0.3))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def plex_connect():
     """
     Connect to the plex server.
     Uses url and token from the file .settings.json, or asks for login credentials and writes .settings.json.
+    The returned server uses a pooled session (see create_session()), it's available via plex._session.
     """
+    from plexapi.myplex import MyPlexAccount # plexapi is slow to import, so only import it when connecting
+    from plexapi.server import PlexServer
+
     settings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.settings.json')
     if os.path.exists(settings_file):
         try:
             # Load connection settings
-            with open(settings_file, 'r') as f:
-                settings = json.load(f)
+            with open(settings_file, 'rb') as f:
+                settings = json_loads(f.read())
 
             # Authenticate with Plex
             print("Connecting to server...", end="", flush=True)
-            return PlexServer(settings['baseurl'], settings['token'])
+            return PlexServer(settings['baseurl'], settings['token'], session=create_session())
         except Exception as e:
             os.unlink(settings_file)
             return plex_connect() # connection failed, retry with username and password
@@ -275,7 +749,25 @@ def plex_connect():
             json.dump(settings, f, indent=4)
         os.chmod(settings_file, stat.S_IRUSR | stat.S_IWUSR)  # read & write permissions for owner only, equivalent to 0o600
 
-        return plex
+        return plex_connect() # reconnect with the saved settings to use the pooled session
+
+
+def read_chunks(response, chunk_size: int = DEFAULT_DOWNLOAD_CHUNK):
+    """
+    Yields the body of a streamed response in chunks.
+    Reads directly from the underlying urllib3 response, that has much less overhead per chunk than response.iter_content().
+    """
+    raw = getattr(response, 'raw', None)
+    if raw is None: # fallback when the raw response isn't available
+        yield from response.iter_content(chunk_size)
+        return
+
+    raw.decode_content = True
+    while True:
+        data = raw.read(chunk_size)
+        if not data:
+            break
+        yield data
 
 
 def run_command(cmd, dry_run=False, verbose=False, raiseException=True, returncode=0, cwd=''):
@@ -359,20 +851,21 @@ def select_destination(paths = []):
         mount_paths = []
         media_dirs = ['/media', '/run/media', '/mnt']
         for media_dir in media_dirs:
-            if os.path.isdir(media_dir):
-                for root, dirs, _ in os.walk(media_dir):
-                    for name in dirs:
-                        mount_path = os.path.join(root, name)
-                        if not os.path.ismount(mount_path):
-                            for root, dirs, _ in os.walk(mount_path):
-                                for name in dirs:
-                                    mount_path = os.path.join(root, name)
-                                    if os.path.ismount(mount_path):
-                                        mount_paths.append(mount_path)
-                                break  # avoid recursive scan
-                        else:
-                            mount_paths.append(mount_path)
-                    break  # avoid recursive scan
+            # mounts are at most 2 levels deep (i.e. /media/disk or /media/user/disk), never scan deeper into the mounted media
+            try:
+                with os.scandir(media_dir) as entries:
+                    dirs = [entry.path for entry in entries if entry.is_dir()]
+            except OSError: # media_dir doesn't exist or isn't readable
+                continue
+            for path in dirs:
+                if os.path.ismount(path):
+                    mount_paths.append(path)
+                    continue
+                try:
+                    with os.scandir(path) as entries:
+                        mount_paths.extend(entry.path for entry in entries if entry.is_dir() and os.path.ismount(entry.path))
+                except OSError:
+                    pass
 
         for mount_path in mount_paths:
             try:
@@ -449,6 +942,7 @@ def select_playlist(plex, playlist_type: Optional[Literal['audio', 'video', 'pho
     if not playlists:
         print('No Playlist available')
         return
+    by_title = {p.title.lower(): p for p in reversed(playlists)} # reversed, so the first playlist wins on duplicate titles
 
     playlist = None
     if choice == None:
@@ -465,16 +959,12 @@ def select_playlist(plex, playlist_type: Optional[Literal['audio', 'video', 'pho
         try:
             playlist = playlists[int(choice)]
         except (ValueError, IndexError):
-            try:
-                playlist = next((p for p in playlists if p.title.lower() == choice.lower()), None)
-            except:
-                pass
-
+            playlist = by_title.get(choice.lower())
             if playlist == None:
                 return select_playlist(plex, playlist_type, smart, None)
     else:
         try:
-            playlist = next((p for p in playlists if p.title.lower() == choice.lower()), None)
+            playlist = by_title.get(choice.lower())
             if playlist == None and multiple:
                 try:
                     pattern = re.compile(choice, re.IGNORECASE)
@@ -573,10 +1063,8 @@ def select_server(account):
         try:
             server = servers[int(choice)]
         except (ValueError, IndexError):
-            try:
-                server = next((s for s in servers if s.name.lower() == choice.lower()), None)
-            except:
-                pass
+            by_name = {s.name.lower(): s for s in reversed(servers)} # reversed, so the first server wins on duplicate names
+            server = by_name.get(choice.lower())
 
         if server == None:
             return select_server(account)
@@ -591,6 +1079,13 @@ def select_user(plex, choice: Optional[str] = None):
     """
     myPlexAccount = plex.myPlexAccount()
     users = [myPlexAccount] + myPlexAccount.users()
+    # users can be chosen by username or email, reversed so the first user wins on duplicates
+    by_name = {}
+    for u in reversed(users):
+        if u.email:
+            by_name[u.email.lower()] = u
+        if u.username:
+            by_name[u.username.lower()] = u
 
     user = None
     if choice == None:
@@ -602,41 +1097,39 @@ def select_user(plex, choice: Optional[str] = None):
         try:
             user = users[int(choice)]
         except (ValueError, IndexError):
-            try:
-                user = next((u for u in users if (u.username.lower() == choice.lower()) or (u.email.lower() == choice.lower())), None)
-            except:
-                pass
-
+            user = by_name.get(choice.lower())
             if user == None:
                 return select_user(plex, choice)
     else:
-        try:
-            user = next((u for u in users if (u.username.lower() == choice.lower()) or (u.email.lower() == choice.lower())), None)
-        except:
-            pass
+        user = by_name.get(choice.lower())
         if user == None:
             print(f"\r\033[KUser '{choice}' not found!")
             return
 
     print(f'\r\033[KUser: {user.username} ({user.email})')
     print("Connecting with user token...", end="\r", flush=True)
+    from plexapi.server import PlexServer # see plex_connect()
+
     token = getattr(user, 'authenticationToken', False)
     if not token:
         token = user.get_token(plex.machineIdentifier)
-    return PlexServer(plex._baseurl, token)
+    return PlexServer(plex._baseurl, token, session=plex._session)
 
 
 def size_str(sizeBytes):
     """
     Converts the size to human readable format.
     """
-    if sizeBytes == 0:
+    sizeBytes = int(sizeBytes)
+    if sizeBytes <= 0:
         return "0B"
     sizeName = ("iB", "KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB")
-    i = int(math.floor(math.log(sizeBytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(sizeBytes / p, 2)
-    return "{:0.2f} {}".format(s, sizeName[i])
+    i = min((sizeBytes.bit_length() - 1) // 10, len(sizeName) - 1) # each unit is 2^10 times bigger than the previous one
+    return f"{sizeBytes / (1 << (i * 10)):0.2f} {sizeName[i]}"
+
+
+# Normalized, lowercase locations of each section (section.key -> list of locations), used in unique_path()
+section_locations_cache = {}
 
 
 def unique_path(section, item, media_ix=0, part_ix=0):
@@ -647,11 +1140,16 @@ def unique_path(section, item, media_ix=0, part_ix=0):
     """
     # the path can be linux and the script runs on windows or vice versa
     # so the paths are normalized to the OS running this script
+    locations = section_locations_cache.get(section.key)
+    if locations is None:
+        # the join forces a trailing path separator
+        locations = [os.path.join(os.path.normpath(location), "").lower() for location in section.locations]
+        section_locations_cache[section.key] = locations
+
     file = os.path.normpath(item.media[media_ix].parts[part_ix].file)
-    for location in section.locations:
-        loc = os.path.normpath(location)
-        loc = os.path.join(loc, "").lower() # the join forces a trailing path separator
-        if file.lower().startswith(loc):
+    fileL = file.lower()
+    for loc in locations:
+        if fileL.startswith(loc):
             # remove location from path, check each part for illegal characters
             path = ''
             for part in file[len(loc):].split(os.sep):
@@ -659,9 +1157,42 @@ def unique_path(section, item, media_ix=0, part_ix=0):
             return path
 
 
+def would_download_bytes(plex, item, basepath: Optional[str] = 'Downloads'):
+    """
+    Returns how many bytes download_item() would download for the item.
+
+    The sizes of the media parts are already loaded with the item, so fully downloaded files are
+    checked locally only. A request to the server is only needed to verify partially downloaded files.
+    """
+    total_download_size = 0
+    part_files = get_part_files(item, basepath)
+    local_sizes = get_local_file_sizes(file for _, file in part_files)
+    for part, file in part_files:
+        if file in local_sizes:
+            existing_filesize = local_sizes[file]
+            if part.size == existing_filesize:
+                continue # file already exists
+            if compare_partial_file(plex, part, file): # file exists partially, download would be resumed
+                total_download_size += part.size - existing_filesize
+                continue
+        else:
+            ranges = get_partial_ranges(plex, part, file, remove_stale=False)
+            if ranges is not None: # interrupted download with multiple connections, the missing ranges would be downloaded
+                total_download_size += sum(end - offset + 1 for offset, end in ranges)
+                continue
+        total_download_size += part.size
+    return total_download_size
+
+
 def handle_sigint(signal_received, frame):
+    stop_event.set()
     print("\nStopped by user (Ctrl+C)")
     sys.exit(0)
 
-# Install Ctrl+C signal handler for all scripts
-signal.signal(signal.SIGINT, handle_sigint)
\ No newline at end of file
+
+def install_sigint_handler():
+    """
+    Installs the Ctrl+C signal handler, all scripts call this before running main().
+    It's not installed on import, so importing this module has no side effects.
+    """
+    signal.signal(signal.SIGINT, handle_sigint)
@@ -13,24 +13,81 @@ Dependencies: ffmpeg and ffprobe must be installed on the system.
 """
 
 import argparse
-import json
 import os
 import re
-import requests
+import shelve
+import subprocess
 import tempfile
-from pathlib import PurePath
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from plexapi.collection import Collection
 from tqdm import tqdm
-from plexHelpers import plex_connect, run_command, select_section
+from plexHelpers import install_sigint_handler, json_loads, plex_connect, run_command, select_section
 
 
 # for removing youtube id from title
 patternYTid = re.compile(r"\[[\S]+\]") # youtube video id (regex: '[...]' with a content of all except whitespace)
 
+# file extensions of embedded thumbnails that are uploaded as poster
+thumbnail_extensions = frozenset(['.jpg', '.jpeg', '.png', '.webp'])
 
-def get_video_info(filename):
+# ffprobe results of already probed files, so re-runs (i.e. after an aborted run) don't need to download and probe them again
+info_cache_file = os.path.join(os.path.expanduser('~'), '.cache', 'plex-helpers', 'ffprobe')
+info_cache_lock = threading.Lock() # shelve doesn't support concurrent access, items are processed in parallel
+
+
+def load_cached_info(part):
+    """
+    Returns the cached video info of the media part, or None.
+    The size is part of the key, so the info of changed files isn't used.
+    """
+    with info_cache_lock:
+        try:
+            with shelve.open(info_cache_file, 'r') as cache:
+                return cache.get(f'{part.key}:{part.size}')
+        except Exception: # cache doesn't exist yet or can't be read
+            return None
+
+
+def save_cached_info(part, info):
+    """
+    Saves the video info of the media part in the cache.
+    """
+    with info_cache_lock:
+        os.makedirs(os.path.dirname(info_cache_file), exist_ok=True)
+        with shelve.open(info_cache_file) as cache:
+            cache[f'{part.key}:{part.size}'] = info
+
+
+def to_int(value, default=0):
+    """
+    Returns value as int, or default when it's missing or not a number (i.e. 'N/A').
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def dig(d, *keys, default=None):
+    """
+    Returns the value of nested dicts, i.e. dig(d, 'format', 'tags', 'PURL') for d['format']['tags']['PURL'],
+    or default when a key doesn't exist.
+    """
+    for key in keys:
+        d = d.get(key) if isinstance(d, dict) else None
+        if d is None:
+            return default
+    return d
+
+
+def get_video_info(tmp, chunks=None):
     '''
-    Uses ffprobe to extract metadata from the video file.
+    Uses ffprobe to extract metadata from the video data.
+
+    The chunks are piped into a single ffprobe process that stops reading as soon as it has enough data.
+    All chunks that were read are also written into the temporary file tmp (i.e. to extract a thumbnail afterwards).
+    Without chunks ffprobe reads the temporary file tmp.
 
     Note: Extracts more information than needed here, but i already had this function in another script 
     and didn't bother to clean it up as extracting additional data from json shouldn't make much performance difference.
@@ -53,97 +110,81 @@ def get_video_info(filename):
         "-v", "quiet",                       # hide ffprobe version, options, etc
         "-hide_banner",                      # hide banner
         "-print_format", "json",             # output json format
-        "-show_entries", "format:stream",    # output all format end stream entries
-        # "-show_entries", "format=bit_rate:stream=codec_name:stream=codec_type:stream=width:stream=channels",  # overall bitrate, stream codec type, width and channels
-        filename,
+        "-probesize", "2M",                  # only the first 2MB are downloaded, don't try to read further
+        "-analyzeduration", "2M",            # stop analyzing after 2 seconds of media
+        # only output the entries used below: size, bitrate and all tags of the format, codec type/name, width, channels, bitrate and language of the streams
+        "-show_entries", "format=size,bit_rate:format_tags:stream=codec_type,codec_name,width,channels,bit_rate:stream_tags=language",
+        "-i", "pipe:0" if chunks is not None else tmp.name, # read from stdin or the temporary file
     ]
 
-    stdout, _, returncode = run_command(cmd, raiseException=False) # any error is handled in run_command
-    if returncode == 0:
-        d = json.loads(stdout)
-
+    if chunks is None:
+        tmp.flush() # needs flush because file is then read with external program 'ffprobe'
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+    for chunk in chunks or ():
+        tmp.write(chunk)
         try:
-            filesize = int(d['format']['size'])
-        except:
-            filesize = os.path.getsize(filename)
-            pass
-
+            process.stdin.write(chunk)
+        except BrokenPipeError: # ffprobe exited, it has read all data it needs
+            break
+    if process.stdin:
         try:
-            bitrate = int(d['format']['bit_rate'])
-        except:
+            process.stdin.close()
+        except BrokenPipeError:
             pass
+    stdout = process.stdout.read()
+    returncode = process.wait()
+    tmp.flush()
+    filename = tmp.name
+
+    if returncode == 0:
+        d = json_loads(stdout) # orjson when installed, see plexHelpers
+
+        filesize = to_int(dig(d, 'format', 'size')) # not used here, only the first bytes of the file are downloaded anyway
+        bitrate = to_int(dig(d, 'format', 'bit_rate'))
 
         # add url to description
-        try:
-            description = d['format']['tags']['PURL'] + '\n\n'
-        except:
-            pass
+        purl = dig(d, 'format', 'tags', 'PURL')
+        if purl is not None:
+            description = purl + '\n\n'
         # comment mostly includes the same url as in PURL, so only add it when different
-        try:
-            comment = d['format']['tags']['COMMENT'] + '\n\n'
+        comment = dig(d, 'format', 'tags', 'COMMENT')
+        if comment is not None:
+            comment += '\n\n'
             if comment.lower() != description.lower():
                 description += comment
-        except:
-            pass
         # add description
-        try:
-            description += d['format']['tags']['DESCRIPTION']
-        except:
-            pass
+        description += dig(d, 'format', 'tags', 'DESCRIPTION', default='')
 
         # add artist
-        try:
-            artist += d['format']['tags']['ARTIST']
-        except:
-            pass
+        artist += dig(d, 'format', 'tags', 'ARTIST', default='')
 
-        # add tags
-        try:
-            tags = d['format']['tags']
-        except:
-            pass
-        # make tags keys lowercase
-        tags = {k.lower():v for k, v in tags.items()}
+        # add tags, with lowercase keys
+        tags = {k.lower():v for k, v in dig(d, 'format', 'tags', default={}).items()}
 
         # parse streams
-        for stream in d['streams']:
-            try:
-                # there is usually only one video stream
-                if stream['codec_type'] == 'video':
-                    try:
-                        width = stream['width']
-                        codec = stream['codec_name']
-                    except:
-                        pass
-                # parse audio streams (usually one or multiple)
-                elif stream['codec_type'] == 'audio':
-                    try:
-                        # max channel count
-                        if stream['channels'] > channels:
-                            channels = stream['channels']
-                    except:
-                        pass
-
-                    try:
-                        # max channel bitrate
-                        if int(stream['bit_rate']) > bitrateAudio:
-                            bitrateAudio = int(stream['bit_rate'])
-                    except:
-                        pass
-
-                    try:
-                        # get audio languages
-                        lang = stream['tags']['language'].lower()
-                        if lang not in languages:
-                            languages.append(lang)
-                    except:
-                        pass
-
-                # get attachment count
-                elif stream['codec_type'] == 'attachment':
-                    attachments += 1
-            except:
-                pass
+        for stream in d.get('streams', []):
+            codec_type = stream.get('codec_type')
+            # there is usually only one video stream
+            if codec_type == 'video':
+                width = stream.get('width', width)
+                codec = stream.get('codec_name', codec)
+            # parse audio streams (usually one or multiple)
+            elif codec_type == 'audio':
+                # max channel count
+                channels = max(channels, to_int(stream.get('channels')))
+
+                # max channel bitrate
+                bitrateAudio = max(bitrateAudio, to_int(stream.get('bit_rate')))
+
+                # get audio languages
+                lang = dig(stream, 'tags', 'language')
+                if lang and lang.lower() not in languages:
+                    languages.append(lang.lower())
+
+            # get attachment count
+            elif codec_type == 'attachment':
+                attachments += 1
 
         return {
             'artist': artist,
@@ -161,6 +202,19 @@ def get_video_info(filename):
         }
 
 
+def read_growing_chunks(response, chunk_size, max_chunk_size=1024*1024):
+    """
+    Yields the content of a streamed response in chunks, starting with chunk_size and doubling up to max_chunk_size.
+    Small chunks first so ffprobe can start early, bigger ones later for less overhead when more data is needed.
+    """
+    while True:
+        chunk = response.raw.read(chunk_size, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+        chunk_size = min(chunk_size * 2, max_chunk_size)
+
+
 def set_embedded_thumbnail(item, file):
     """
     Extracts a thumbnail from the video and uploads it as a poster to plex.
@@ -181,10 +235,10 @@ def set_embedded_thumbnail(item, file):
         if returncode == 1: # yes, this ffmpeg command returns 1 on success and on failure
             attachments = os.listdir(tmpdir)
             if len(attachments) > 1:
-                print(f'\r\033[K{item.title}: found multiple attachments: {attachments.join(', ')}')
+                print(f'\r\033[K{item.title}: found multiple attachments: {", ".join(attachments)}')
                 return
             for attachment in attachments:
-                if PurePath(attachment).suffix.lower() in ['.jpg', '.webp']:
+                if os.path.splitext(attachment)[1].lower() in thumbnail_extensions:
                     return item.uploadPoster(filepath=os.path.join(tmpdir, attachment)) # it's uploaded and set as default poster
                 else:
                     print(f'\r\033[K{item.title}: found attachment of unknown type: {attachment}')
@@ -196,28 +250,52 @@ def addEmbeddedMetadata(plex, item):
     Downloads the first 2MB of the file, extracts metadata and updates the metadata in plex.
     """
 
-    # Download up to 2MB in 256kB chunks and try to get video information via ffprobe.
+    # Download up to 2MB in growing chunks and pipe them into ffprobe to get video information.
     # This works on container files like mkv/mp4 where the file metadata is stored in the first 1-2MB.
     info = None
     byte_limit = 2*1024*1024 # 2MB or filesize when file is smaller
-    chunk_size = 256*1024  # up to 8 chunks a'la 256kB (for most mkv files without thumbnail 256kB should be enough to parse metadata, mp4 needs >1MB)
+    chunk_size = 256*1024  # for most mkv files without thumbnail 256kB should be enough to parse metadata, mp4 needs >1MB
     headers = {'Range': f'bytes=0-{byte_limit - 1}', 'X-Plex-Token': plex._token}
     for media in item.media:
         for part in media.parts:
-            response = requests.get(f'{plex._baseurl}{part.key}', headers=headers, stream=True)
-            with tempfile.NamedTemporaryFile() as tmp:
-                for chunk in response.iter_content(chunk_size):
-                    tmp.write(chunk)
-                    tmp.flush() # needs flush because file is then read with external program 'ffprobe'
-
-                    info = get_video_info(tmp.name)
-                    if info:
-                        if info['attachments'] > 0: # attached thumbnail available, extract as long as the temporary file is available
-                            if set_embedded_thumbnail(item, tmp.name): # may need more than one chunk
-                                break
-                        else: break
-                    # else: not enough data, continue downloading next chunk
-            if info: break
+            info = load_cached_info(part)
+            if info and info['attachments'] == 0:
+                break # already probed, no thumbnail that needs the file
+            info = None
+
+            # use plex's session (see create_session in plexHelpers) so connections are reused instead of a new TCP/TLS handshake per part,
+            # the response is closed after use, also when ffprobe stopped reading before all data was downloaded
+            url = f'{plex._baseurl}{part.key}'
+            with plex._session.get(url, headers=headers, stream=True) as response, \
+                 tempfile.NamedTemporaryFile() as tmp:
+                chunks = read_growing_chunks(response, chunk_size)
+                info = get_video_info(tmp, chunks) # stops downloading when ffprobe has enough data
+                if info and info['attachments'] > 0:
+                    # attached thumbnail available, download the rest of the 2MB and extract it while the temporary file is available
+                    for chunk in chunks:
+                        tmp.write(chunk)
+                    tmp.flush() # needs flush because file is then read with external program 'ffmpeg'
+                    set_embedded_thumbnail(item, tmp.name)
+                elif not info and part.container == 'mp4' and (part.size or 0) > byte_limit:
+                    # mp4 files may have the metadata (moov atom) at the end, which ffprobe can't seek to when reading from a pipe.
+                    # Write the first and last 2MB at their position into a sparse file with the size of the video and let ffprobe read that.
+                    tail_headers = {'Range': f'bytes={part.size - byte_limit}-', 'X-Plex-Token': plex._token}
+                    with plex._session.get(url, headers=tail_headers, stream=True) as tail:
+                        # skip the tail probe on errors (an exception would stop processing all items) and when the server
+                        # ignored the range, then it would send the whole video which would be written at the wrong offset
+                        tail_received = tail.status_code == 206
+                        if tail_received:
+                            for chunk in chunks:
+                                tmp.write(chunk)
+                            tmp.truncate(part.size)
+                            tmp.seek(part.size - byte_limit)
+                            for chunk in read_growing_chunks(tail, chunk_size):
+                                tmp.write(chunk)
+                    if tail_received:
+                        info = get_video_info(tmp)
+            if info:
+                save_cached_info(part, info)
+                break
         if info: break
 
     if not info:
@@ -254,6 +332,12 @@ def main():
         type=str,
         help="Title of section"
     )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=min(8, os.cpu_count() or 1), # each worker may run ffprobe, so not more than cpu cores
+        help="Number of items processed in parallel (default: number of cpu cores, max 8)"
+    )
     parser.add_argument('-y', '--yes', action='store_true', help="Don't ask for 'Press Y to continue'")
     args = parser.parse_args()
 
@@ -268,7 +352,10 @@ def main():
     items = []
     # filter out items where the summary starts with 'http' (fast) or the summary is locked (slow)
     # because in each of these cases it is assumed that metadata was already set
-    for item in tqdm(section.all(), desc='\r\033[KFiltering...'):
+    # Note: this can't be filtered on the server, plex has no 'doesn't begin with' operator and 'doesn't contain'
+    # would also skip unprocessed items with 'http' somewhere in the summary.
+    # Items are loaded in pages of 1000 instead of plexapi's default of 100 to need less requests on big sections.
+    for item in tqdm(section.all(container_size=1000), desc='\r\033[KFiltering...'):
         if (not item.summary.startswith('http') 
             and (not item.fields or not any(f.name == 'summary' and f.locked for f in item.fields))):
             items.append(item)
@@ -283,11 +370,19 @@ def main():
             exit(1)
 
     print(f'\r\033[KUpdating metadata in {section.title}...')
-    for item in tqdm(items):
-        addEmbeddedMetadata(plex, item)
+    # process items in parallel, most of the time is spent waiting for the server and ffprobe
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(addEmbeddedMetadata, plex, item) for item in items]
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                future.result() # raise exceptions from the threads
+        except BaseException: # i.e. Ctrl+C: don't process the remaining items (leaving the with block would wait for all of them)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     print("\r\033[KFinished")
 
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
\ No newline at end of file
@@ -6,9 +6,14 @@ Many thanks to https://github.com/dfatih/PlexMusicDeDuplicator and https://githu
 """
 
 import argparse
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from operator import itemgetter
 from tqdm import tqdm
-from plexHelpers import mood_add, mood_del, get_moods_via_autocomplete, get_track_quality, plex_connect, select_playlist, select_user
+from plexHelpers import install_sigint_handler, mood_add, mood_del, get_moods_via_autocomplete, get_track_quality, plex_connect, select_playlist, select_user
+
+# for removing spaces from attribute values in the duplicate key
+remove_spaces_table = str.maketrans('', '', ' ')
 
 def main():
     """
@@ -58,6 +63,8 @@ def main():
     if not isinstance(playlists, list):
         playlists = [playlists]
 
+    matchAttrs = tuple(args.match)
+
     # remove duplicates from selected playlists
     multiple_playlists = len(playlists) > 1
     for playlist_ix, playlist in enumerate(playlists):
@@ -71,20 +78,16 @@ def main():
 
         print("\r\033[KLoading moods...", end="", flush=True)
         moods = get_moods_via_autocomplete(plex, section, 'Duplicate ')       # all 'Duplicate *' moods
-        mood = next((m for m in moods if m.title.lower() == moodNameL), None) # mood for this playlist (may not exist at this time)  
+        moodsByName = {m.title.lower(): m for m in moods}
+        mood = moodsByName.get(moodNameL) # mood for this playlist (may not exist at this time)
 
         print("\r\033[KLoading filter...", end="", flush=True)
         filters = playlist.filters()['filters']
         # delete all filters with 'track.mood!' containing a id of a 'Duplicate *' mood
-        for key in filters:
-            if isinstance(filters[key], list):
-                for i, f in enumerate(filters[key]):
-                    for k, v in f.items():
-                        if k == 'track.mood!':
-                            for m in moods:
-                                if v == m.key:
-                                    filters[key].pop(i)
-                                    break
+        moodKeys = {m.key for m in moods}
+        for key, value in filters.items():
+            if isinstance(value, list):
+                filters[key] = [f for f in value if f.get('track.mood!') not in moodKeys]
 
         # Run searchTracks with the modified filter so we get all songs that would be in the playlist without any 'Duplicate *' moods filter to
         # - always mark the best quality version of duplicates as unique
@@ -121,25 +124,30 @@ def main():
         uniqueTracks = []    # List with unique tracks
         duplicateTracks = [] # List with duplicates
         # The playlist may be huge (many thousands of tracks), this is a fast way to check for duplicates:
-        # Create a dictionary with the index containing of a string of the track attrs values specified in --mode
-        # Each element in the dictionary contains a list of 1..n tracks
-        trackDup = defaultdict(list)
-        for track in tracks:
-            dupGuid = ''
-            for attr in args.match:
-                dupGuid = dupGuid + str(getattr(track, attr, '')).replace(' ', '').lower()
-            trackDup[dupGuid].append(track)
+        # Sort the tracks by a key built from the track attrs values specified in --match, then tracks with the same key are
+        # next to each other and can be grouped in one pass. The sort is stable, so tracks keep their order within a group.
+        if matchAttrs == ('guid',): # default, the guid alone is the key
+            keyedTracks = [((track.guid or '').translate(remove_spaces_table).lower(), track) for track in tracks]
+        else:
+            keyedTracks = []
+            for track in tracks:
+                dupKey = []
+                for attr in matchAttrs:
+                    value = getattr(track, attr, '')
+                    # values are converted to strings so the keys are always comparable when sorting (i.e. a duration may be None)
+                    dupKey.append(value.translate(remove_spaces_table).lower() if isinstance(value, str) else str(value))
+                keyedTracks.append((tuple(dupKey), track))
+        keyedTracks.sort(key=itemgetter(0))
 
         # Now just split it in 2 lists, one for unique and one for duplicate tracks,
         # When there are duplicates the one with the best quality is choosen to be the unique one.
-        for trackList in trackDup.values():
+        for _, group in groupby(keyedTracks, key=itemgetter(0)):
+            trackList = [track for _, track in group]
             if len(trackList) > 1:
                 # Sort tracks by codec, then bitrate, then sample rate
                 trackList.sort(key=get_track_quality, reverse=True)
-                uniqueTracks.extend(trackList[:1])     # Mark best quality as unique
-                duplicateTracks.extend(trackList[1:])  # Mark others as duplicates
-            else:
-                uniqueTracks.extend(trackList[:1])     # Mark best quality as unique
+            uniqueTracks.append(trackList[0])        # Mark best quality as unique
+            duplicateTracks.extend(trackList[1:])    # Mark others as duplicates
 
         print(f"\r\033[KFound {len(tracks)} tracks: {len(uniqueTracks)} unique and {len(duplicateTracks)} duplicates.")
 
@@ -160,29 +168,27 @@ def main():
                 exit(1)
 
         print(f"Applying mood '{moodName}' to duplicates...")
-        # Note: applying moods in parallel didn't improve speed, this just takes some time
-        with tqdm(total=len(tracks)) as pbar:
-            for track in uniqueTracks:
-                if getattr(track, "hasMood", False): # only delete mood from tracks that have the mood set
-                    mood_del(track, moodName) # delete mood, in case tracks have it set so they are not filtered any more
-                    pbar.update(1)
-                    pbar.refresh()
-                else: # mood already set, nothing to do
-                    pbar.update(1)
-
-            for track in duplicateTracks:
-                if not getattr(track, "hasMood", False): # only add mood to tracks that haven't the mood set
-                    mood_add(track, moodName) # add mood, so tracks can be filtered
-                    pbar.update(1)
-                    pbar.refresh()
-                else: # mood already set, nothing to do
+        # only tracks where the mood changes need a request, these are sent in parallel as it's mostly waiting for the server
+        changes = [(mood_del, track) for track in uniqueTracks if getattr(track, "hasMood", False)]        # delete mood, in case tracks have it set so they are not filtered any more
+        changes += [(mood_add, track) for track in duplicateTracks if not getattr(track, "hasMood", False)] # add mood, so tracks can be filtered
+        with tqdm(total=len(tracks), initial=len(tracks) - len(changes)) as pbar, ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [executor.submit(func, track, moodName) for func, track in changes]
+            try:
+                for future in as_completed(futures):
+                    future.result() # raise exceptions from the threads
                     pbar.update(1)
+            except BaseException: # i.e. Ctrl+C: don't apply the remaining moods (leaving the with block would wait for all of them)
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
         if not mood:
             print(f"\r\033[KUpdating smart playlist filter to exclude tracks with mood '{moodName}'...", end='', flush=True)
 
-            moods = get_moods_via_autocomplete(plex, section, 'Duplicate ')       # all 'Duplicate *' moods
-            mood = next((m for m in moods if m.title.lower() == moodNameL), None) # mood for this playlist (must now exist)
+            # only load the new mood instead of reloading all 'Duplicate *' moods
+            newMoods = get_moods_via_autocomplete(plex, section, moodName, refresh=True)
+            mood = {m.title.lower(): m for m in newMoods}.get(moodNameL) # mood for this playlist (must now exist)
+            if mood:
+                moods.append(mood) # keep the (cached) list of all 'Duplicate *' moods up to date for the next playlists and the cleanup
 
             # add filter to exclude mood
             k,v = next(iter(filters.items()))
@@ -197,9 +203,9 @@ def main():
 
     # Cleanup unused 'Duplicate *' moods (whenever a playlist was renamed the old mood still exists and should be deleted)
     print("\r\033[KChecking for unused 'Duplicate *' moods...", end="", flush=True)
-    playlists_all = plex.playlists()
+    playlistTitles = {p.title for p in plex.playlists()}
     for mood in moods:
-        if any(p.title == mood.title[len('Duplicate '):] for p in playlists_all):
+        if mood.title[len('Duplicate '):] in playlistTitles:
             continue # playlist for 'Duplicate *' mood existing, nothing to clean up
 
         print(f"\r\033[KCleaning up unused mood '{mood.title}'...")
@@ -217,4 +223,5 @@ def main():
 
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
\ No newline at end of file
@@ -8,11 +8,11 @@ Should work with every section type, but only makes sense if you organized your
 """
 
 import argparse
-import os
-from pathlib import PurePath
+from collections import defaultdict
 from plexapi.collection import Collection
+from plexapi.exceptions import NotFound
 from tqdm import tqdm
-from plexHelpers import plex_connect, select_section
+from plexHelpers import install_sigint_handler, plex_connect, select_section
 
 def main():
     """
@@ -46,34 +46,38 @@ def main():
             exit(1)
 
     print(f'\r\033[KUpdating collections in {section.title}...')
-    collections = {}
-    locations = [os.path.normpath(l) for l in section.locations]
+    batch_size = 100 # items per request, see fetch_items_metadata() in plexHelpers
+    collectionItems = defaultdict(list) # items per collection name, added with one request per collection
+    # Paths are from the server, so they use the server's path separator. They are compared with '/' as separator,
+    # with a trailing '/' on the locations and longest first, so nested locations match before their parents.
+    locations = sorted((l.replace('\\', '/').rstrip('/') + '/' for l in section.locations), key=len, reverse=True)
 
-    for item in tqdm(section.all()):
-        path = os.path.dirname(os.path.normpath(item.locations[0]))
+    for item in tqdm(section.all(), desc='\r\033[KLoading items'):
+        path = item.locations[0].replace('\\', '/').rpartition('/')[0] # directory of the file
         name = 'Others' # default collection name for files not in a subdirectory
         for location in locations:
-            try:
-                name = PurePath(path).relative_to(location).parts[0]
+            if path.startswith(location):
+                name = path[len(location):].split('/', 1)[0]
                 break
-            except:
-                pass
+        collectionItems[name].append(item)
 
+    for name, items in tqdm(collectionItems.items(), desc='\r\033[KUpdating collections'):
         try:
-            if name in collections:
-                collection = collections[name]
-            else:
-                collection = section.collection(name)
-                collections[name] = collection
+            collection = section.collection(name)
+            # load the collection items once, only add the items not in the collection yet
+            members = {i.ratingKey for i in collection.items()}
+            items = [i for i in items if i.ratingKey not in members]
+        except NotFound:
+            collection = Collection.create(plex, name, section, items[:batch_size]) # create with the first batch
+            items = items[batch_size:]
 
-            if not item in collection.items():
-                collection.addItems([item])
-        except:
-            collection = Collection.create(plex, name, section, [item])
-            collections[name] = collection
+        # plexapi puts all ratingKeys in the url, add them in batches to stay below the url length limit
+        for i in range(0, len(items), batch_size):
+            collection.addItems(items[i:i + batch_size])
 
     print("\r\033[KFinished")
 
 
 if __name__ == '__main__':
+    install_sigint_handler()
     main()
\ No newline at end of file